@@ -2,9 +2,13 @@
 """LangChain agent for the Character Appearance Count task."""
 
 import argparse
+import asyncio
 import json
 import os
+import re
+import stat
 import sys
+from functools import lru_cache
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -13,16 +17,72 @@ from langchain_core.messages import AIMessage, ToolMessage
 from langchain_core.tools import tool
 from langchain_ollama import ChatOllama
 
+try:
+    import orjson
+except ImportError:  # optional; fall back to the stdlib json module
+    orjson = None
+
 load_dotenv()
 
+_JSON_DECODER = json.JSONDecoder()
+# Braces and JSON strings, for matching braces outside of strings
+_BRACE_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"?|[{}]')
+_JSON_CONTINUATION_RE = re.compile(r"\s*[,:\]}]")
+
 SPEC_DIR = Path(__file__).resolve().parent.parent / "spec"
 INPUTS_DIR = SPEC_DIR / "inputs"
 
+# Upper bound on bytes a single read tool call returns to the model
+MAX_READ_BYTES = 8192
+
 SYSTEM_PROMPT = """\
 You are an autonomous agent that solves tasks by using the tools available to \
 you. Respond with ONLY the final answer in the format requested by the task.\
 """
 
+RETRY_MESSAGE = {
+    "role": "user",
+    "content": "Your previous answer was not valid JSON. "
+    "Please try again and respond with ONLY a JSON object.",
+}
+
+# Extra instruction for speculative attempts after the first, which run
+# alongside it rather than after a failed answer
+SPECULATIVE_MESSAGE = {
+    "role": "user",
+    "content": "Respond with ONLY a JSON object.",
+}
+
+# Sampling temperature for speculative attempts after the first, so they
+# explore different answers instead of repeating the greedy one
+SPECULATIVE_TEMPERATURE = 0.7
+
+
+def _loads(data: str | bytes):
+    """Parse JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps(obj) -> str:
+    """Serialize to 2-space indented JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2)
+
+
+@lru_cache(maxsize=1)
+def _list_inputs(mtime_ns: int) -> str:
+    """Newline-separated transcript filenames, cached per inputs dir mtime."""
+    with os.scandir(INPUTS_DIR) as entries:
+        files = sorted(
+            e.name
+            for e in entries
+            if e.name.endswith(".txt") and e.is_file()
+        )
+    return "\n".join(files)
+
 
 @tool
 def list_input_files() -> str:
@@ -30,23 +90,114 @@ def list_input_files() -> str:
 
     Returns a newline-separated list of filenames.
     """
-    files = sorted(f.name for f in INPUTS_DIR.iterdir() if f.suffix == ".txt")
-    return "\n".join(files)
+    return _list_inputs(INPUTS_DIR.stat().st_mtime_ns)
+
+
+def _trim_partial_utf8(data: bytes) -> bytes:
+    """Drop trailing bytes that start an unfinished UTF-8 character.
+
+    Data that would be left empty is returned as is, so a caller paging
+    through a file always makes progress.
+    """
+    for i in range(1, min(4, len(data)) + 1):
+        b = data[-i]
+        if b < 0x80:
+            break
+        if b >= 0xC0:
+            needed = 2 if b < 0xE0 else 3 if b < 0xF0 else 4
+            if needed > i and i < len(data):
+                return data[:-i]
+            break
+    return data
+
+
+def _truncation_marker(end: int, size: int) -> str:
+    return f"\n...[truncated at byte {end}, total={size} bytes]"
+
+
+@lru_cache(maxsize=64)
+def _read_cached(filename: str, mtime_ns: int, size: int, max_bytes: int) -> str:
+    """Capped contents of an input file, cached per file mtime and size."""
+    fd = os.open(INPUTS_DIR / filename, os.O_RDONLY)
+    try:
+        data = os.read(fd, min(size, max_bytes))
+    finally:
+        os.close(fd)
+    if size <= max_bytes:
+        return data.decode("utf-8", errors="replace")
+    data = _trim_partial_utf8(data)
+    text = data.decode("utf-8", errors="replace")
+    return text + _truncation_marker(len(data), size)
 
 
 @tool
-def read_file(filename: str) -> str:
+def read_file(filename: str, max_bytes: int = MAX_READ_BYTES) -> str:
     """Read the contents of a conversation transcript file.
 
+    Output is capped at max_bytes; if the file is longer, the output ends
+    with a marker giving the byte offset to continue from with read_range.
+
     Args:
         filename: Name of the file to read (e.g. '001.txt').
+        max_bytes: Maximum number of bytes to return, between 1 and 8192
+            (default: 8192). Values below 1 mean the default.
     """
+    if max_bytes < 1 or max_bytes > MAX_READ_BYTES:
+        max_bytes = MAX_READ_BYTES
+    not_found = f"Error: file '{filename}' not found."
+    try:
+        st = os.stat(INPUTS_DIR / filename)
+    except (OSError, ValueError):
+        return not_found
+    if not stat.S_ISREG(st.st_mode):
+        return not_found
+    try:
+        return _read_cached(filename, st.st_mtime_ns, st.st_size, max_bytes)
+    except FileNotFoundError:
+        # Removed between the stat and the open; errors are not cached
+        return not_found
+
+
+@tool
+def read_range(filename: str, offset: int, length: int) -> str:
+    """Read part of a conversation transcript file.
+
+    Output ends with the same truncation marker as read_file if more of the
+    file remains past what was returned.
+
+    Args:
+        filename: Name of the file to read (e.g. '001.txt').
+        offset: Byte offset to start reading from.
+        length: Number of bytes to read (at most 8192).
+    """
+    if offset < 0 or length < 0:
+        return "Error: offset and length must be non-negative."
     path = INPUTS_DIR / filename
     if not path.is_file():
         return f"Error: file '{filename}' not found."
-    return path.read_text()
-
-
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if offset > size:
+                return (
+                    f"Error: offset {offset} is past the end of "
+                    f"'{filename}' ({size} bytes)."
+                )
+            data = os.pread(fd, min(length, MAX_READ_BYTES), offset)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        return f"Error: could not read '{filename}': {e.strerror}."
+    end = offset + len(data)
+    if end >= size:
+        return data.decode("utf-8", errors="replace")
+    data = _trim_partial_utf8(data)
+    text = data.decode("utf-8", errors="replace")
+    return text + _truncation_marker(offset + len(data), size)
+
+
+@lru_cache(maxsize=1)
 def load_task_prompt() -> str:
     """Load the task description from spec files."""
     task_md = (SPEC_DIR / "task.md").read_text()
@@ -54,7 +205,16 @@ def load_task_prompt() -> str:
     return f"{task_md}\n\n---\n\n{format_md}"
 
 
-def build_agent(verbose: bool = False):
+def build_initial_context() -> str:
+    """Task prompt with the transcript listing inlined.
+
+    Saves the agent a list_input_files round-trip; the tool stays available.
+    """
+    files = _list_inputs(INPUTS_DIR.stat().st_mtime_ns)
+    return f"{load_task_prompt()}\n\nAvailable transcripts:\n{files}"
+
+
+def build_agent(verbose: bool = False, temperature: float = 0.0):
     base_url = os.environ.get("OLLAMA_BASE_URL")
     model = os.environ.get("OLLAMA_MODEL")
 
@@ -66,34 +226,87 @@ def build_agent(verbose: bool = False):
         )
         sys.exit(1)
 
-    llm = ChatOllama(base_url=base_url, model=model, temperature=0)
+    return _create_agent(base_url, model, verbose, temperature)
+
+
+@lru_cache(maxsize=4)
+def _create_agent(base_url: str, model: str, verbose: bool, temperature: float):
+    """Create the agent once per (base_url, model, verbose, temperature)."""
+    llm = ChatOllama(base_url=base_url, model=model, temperature=temperature)
 
     return create_agent(
         model=llm,
-        tools=[list_input_files, read_file],
+        tools=[list_input_files, read_file, read_range],
         system_prompt=SYSTEM_PROMPT,
         debug=verbose,
     )
 
 
+def _skip_braced(text: str, start: int) -> int | None:
+    """Index just past the '}' closing the '{' at start, or None if unclosed.
+
+    Braces inside JSON strings are ignored; an unterminated string runs to
+    the end of the text.
+    """
+    depth = 0
+    for token in _BRACE_TOKEN_RE.finditer(text, start):
+        c = token.group()
+        if c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return token.end()
+    return None
+
+
 def extract_json(text: str) -> dict | None:
-    """Try to parse a JSON object from the agent's output text."""
-    try:
-        return json.loads(text)
-    except (json.JSONDecodeError, TypeError):
-        pass
-    start = text.find("{")
-    end = text.rfind("}")
-    if start != -1 and end != -1 and end > start:
+    """Try to parse a JSON object from the agent's output text.
+
+    Decodes in place from each top-level '{' in turn, so leading prose and
+    trailing prose after the object are both tolerated. A balanced candidate
+    that fails to decode is skipped whole, and an object followed by more
+    JSON syntax is rejected, so an object nested inside a broken answer is
+    never returned in its place.
+    """
+    if not isinstance(text, str):
+        return None
+    if text.startswith("{"):
         try:
-            return json.loads(text[start : end + 1])
+            return _loads(text)
         except json.JSONDecodeError:
             pass
+    idx = text.find("{")
+    while idx != -1:
+        try:
+            obj, end = _JSON_DECODER.raw_decode(text, idx)
+        except json.JSONDecodeError:
+            # Skip a balanced candidate whole so an object nested in a broken
+            # answer is not returned; otherwise the '{' was likely just prose
+            skip_to = _skip_braced(text, idx)
+            idx = text.find("{", skip_to if skip_to is not None else idx + 1)
+            continue
+        # An object followed by more JSON syntax is a fragment of a larger,
+        # broken value rather than the answer
+        if not _JSON_CONTINUATION_RE.match(text, end):
+            return obj
+        idx = text.find("{", end)
     return None
 
 
-def run_attempt(agent, messages, debug: bool = False) -> dict | None:
-    """Run a single agent attempt, streaming updates and logging tool calls."""
+def run_attempt(
+    agent, messages, debug: bool = False, stream: bool = True
+) -> dict | None:
+    """Run a single agent attempt.
+
+    When streaming, updates are consumed as they arrive and tool calls are
+    logged; otherwise the agent is invoked once and only the final answer
+    is inspected.
+    """
+    if not stream:
+        result = agent.invoke({"messages": messages})
+        return extract_json(result["messages"][-1].content)
+
     last_ai_content = ""
 
     for chunk in agent.stream({"messages": messages}, stream_mode="updates"):
@@ -118,24 +331,20 @@ def run_attempt(agent, messages, debug: bool = False) -> dict | None:
     return extract_json(last_ai_content)
 
 
-def run(max_attempts: int = 3, verbose: bool = False) -> dict | None:
+def run(
+    max_attempts: int = 3, verbose: bool = False, stream: bool = True
+) -> dict | None:
     agent = build_agent(verbose=verbose)
-    task_prompt = load_task_prompt()
+    task_message = {"role": "user", "content": build_initial_context()}
 
     for attempt in range(1, max_attempts + 1):
         print(f"--- Attempt {attempt}/{max_attempts} ---", file=sys.stderr)
 
-        messages = [{"role": "user", "content": task_prompt}]
+        messages = [task_message]
         if attempt > 1:
-            messages.append(
-                {
-                    "role": "user",
-                    "content": "Your previous answer was not valid JSON. "
-                    "Please try again and respond with ONLY a JSON object.",
-                }
-            )
-
-        parsed = run_attempt(agent, messages, debug=verbose)
+            messages.append(RETRY_MESSAGE)
+
+        parsed = run_attempt(agent, messages, debug=verbose, stream=stream)
         if parsed:
             return parsed
 
@@ -148,6 +357,53 @@ def run(max_attempts: int = 3, verbose: bool = False) -> dict | None:
     return None
 
 
+async def run_async(max_attempts: int = 3, verbose: bool = False) -> dict | None:
+    """Run all attempts concurrently and return the first one that yields JSON.
+
+    Trades token cost for latency: every attempt is started up front and the
+    remaining ones are cancelled as soon as one produces a valid answer. The
+    first attempt matches a sequential first try; the others add
+    SPECULATIVE_MESSAGE and sample at SPECULATIVE_TEMPERATURE so they do not
+    all repeat the same answer.
+    """
+    task_message = {"role": "user", "content": build_initial_context()}
+    first_agent = build_agent(verbose=verbose)
+    retry_agent = build_agent(verbose=verbose, temperature=SPECULATIVE_TEMPERATURE)
+
+    async def attempt(n: int) -> dict | None:
+        if n == 1:
+            agent, messages = first_agent, [task_message]
+        else:
+            agent, messages = retry_agent, [task_message, SPECULATIVE_MESSAGE]
+        try:
+            result = await agent.ainvoke({"messages": messages})
+        except Exception as e:
+            print(f"Attempt {n}: failed: {e}", file=sys.stderr)
+            return None
+        parsed = extract_json(result["messages"][-1].content)
+        if not parsed:
+            print(f"Attempt {n}: could not parse JSON from output.", file=sys.stderr)
+        return parsed
+
+    print(f"--- Running {max_attempts} attempts in parallel ---", file=sys.stderr)
+    tasks = [asyncio.create_task(attempt(n)) for n in range(1, max_attempts + 1)]
+
+    try:
+        for fut in asyncio.as_completed(tasks):
+            parsed = await fut
+            if parsed:
+                return parsed
+    finally:
+        for t in tasks:
+            t.cancel()
+
+    print(
+        f"Failed to get valid JSON after {max_attempts} attempts.",
+        file=sys.stderr,
+    )
+    return None
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Run the LangChain agent for Character Appearance Count."
@@ -163,12 +419,37 @@ def main():
         action="store_true",
         help="Print agent reasoning traces to stderr",
     )
+    parser.add_argument(
+        "--speculative",
+        action="store_true",
+        help="Run all attempts in parallel and keep the first valid answer "
+        "(faster, but spends up to --max-attempts times the tokens)",
+    )
+    parser.add_argument(
+        "--stream",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Stream agent updates and log tool calls (default: on; "
+        "sequential mode only)",
+    )
     args = parser.parse_args()
 
-    result = run(max_attempts=args.max_attempts, verbose=args.verbose)
+    if args.speculative and args.stream is not None:
+        parser.error("--stream/--no-stream cannot be used with --speculative")
+
+    if args.speculative:
+        result = asyncio.run(
+            run_async(max_attempts=args.max_attempts, verbose=args.verbose)
+        )
+    else:
+        result = run(
+            max_attempts=args.max_attempts,
+            verbose=args.verbose,
+            stream=args.stream is not False,
+        )
 
     if result is not None:
-        print(json.dumps(result, indent=2))
+        print(_dumps(result))
     else:
         sys.exit(1)
 
@@ -2,20 +2,33 @@
 """Generate theater-style conversation transcript files using an LLM via Ollama."""
 
 import argparse
+import asyncio
+import itertools
 import json
 import logging
 import os
 import random
 import re
 import sys
-import time
+from functools import lru_cache
 from pathlib import Path
 
-from openai import OpenAI
+from openai import AsyncOpenAI
+
+try:
+    import orjson
+except ImportError:  # optional; fall back to the stdlib json module
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
-MESSAGE_RE = re.compile(r"^([a-z]+): (.+)$")
+MESSAGE_RE = re.compile(r"(?m)^([a-z]+): (.+)$")
+# One match per line: (name, "") for messages, ("", "") for blank lines,
+# ("", line) for anything else
+LINE_RE = re.compile(r"(?m)^(?:([a-z]+): .+|[^\S\n]*|(.*))$")
+# Line boundaries recognized by str.splitlines() other than "\n"
+OTHER_LINE_BREAK_RE = re.compile("[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+LOWER_NAME_RE = re.compile(r"\A[a-z]+\Z")
 
 TOPICS = [
     "planning a surprise birthday party",
@@ -41,28 +54,47 @@ TOPICS = [
 ]
 
 
+SYSTEM_PROMPT_TEMPLATE = (
+    "You are a conversation transcript generator. You produce theater-style "
+    "conversation transcripts that strictly follow a specific format.\n\n"
+    "## Format Rules\n\n"
+    "{format_spec}\n\n"
+    "## Critical Instructions\n\n"
+    "- Output ONLY the conversation transcript, nothing else.\n"
+    "- No headers, titles, labels, or commentary.\n"
+    "- No markdown code fences.\n"
+    "- Every non-blank line MUST match the pattern: <lowercase_name>: <message>\n"
+    "- Character names must be strictly lowercase letters only.\n"
+    "- Do not use any characters outside the ones specified.\n"
+    "- Blank lines between messages are allowed but not required.\n"
+)
+
+
+def _loads(data: str | bytes):
+    """Parse JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps(obj) -> str:
+    """Serialize to 2-space indented JSON, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2)
+
+
+@lru_cache(maxsize=1)
 def load_format_spec() -> str:
     """Load the format specification from spec/format.md."""
     format_path = Path(__file__).parent / "format.md"
     return format_path.read_text(encoding="utf-8")
 
 
+@lru_cache(maxsize=4)
 def build_system_prompt(format_spec: str) -> str:
     """Build the system prompt with embedded format rules."""
-    return (
-        "You are a conversation transcript generator. You produce theater-style "
-        "conversation transcripts that strictly follow a specific format.\n\n"
-        "## Format Rules\n\n"
-        f"{format_spec}\n\n"
-        "## Critical Instructions\n\n"
-        "- Output ONLY the conversation transcript, nothing else.\n"
-        "- No headers, titles, labels, or commentary.\n"
-        "- No markdown code fences.\n"
-        "- Every non-blank line MUST match the pattern: <lowercase_name>: <message>\n"
-        "- Character names must be strictly lowercase letters only.\n"
-        "- Do not use any characters outside the ones specified.\n"
-        "- Blank lines between messages are allowed but not required.\n"
-    )
+    return SYSTEM_PROMPT_TEMPLATE.format(format_spec=format_spec)
 
 
 def build_user_prompt(characters: list[str], message_count: int, topic: str) -> str:
@@ -80,81 +112,105 @@ def build_user_prompt(characters: list[str], message_count: int, topic: str) ->
     )
 
 
+def normalize_lines(text: str) -> str:
+    """Strip text and make "\\n" its only line break.
+
+    The validators below only split lines on "\\n"; this makes them agree with
+    str.splitlines(). Text without other line breaks is returned unchanged.
+    """
+    text = text.strip()
+    if OTHER_LINE_BREAK_RE.search(text):
+        text = "\n".join(text.splitlines())
+    return text
+
+
 def validate_transcript(text: str, allowed_characters: set[str]) -> tuple[bool, str]:
     """Validate a generated transcript against format rules.
 
+    Expects text with "\\n" line breaks (see normalize_lines).
     Returns (is_valid, error_message).
     """
-    lines = text.strip().splitlines()
-    if not lines:
+    text = text.strip()
+    if not text:
         return False, "Empty transcript"
 
-    seen_characters = set()
     message_count = 0
 
-    for i, line in enumerate(lines, 1):
-        if line.strip() == "":
-            continue
+    for i, (name, invalid) in enumerate(LINE_RE.findall(text), 1):
+        if name:
+            if name not in allowed_characters:
+                return False, f"Line {i}: unexpected character {name!r}"
+            message_count += 1
+        elif invalid:
+            return False, f"Line {i}: invalid format: {invalid!r}"
 
-        match = MESSAGE_RE.match(line)
-        if not match:
-            return False, f"Line {i}: invalid format: {line!r}"
+    if message_count == 0:
+        return False, "No valid messages found"
 
-        name = match.group(1)
-        seen_characters.add(name)
+    return True, ""
 
-        if name not in allowed_characters:
-            return False, f"Line {i}: unexpected character {name!r}"
 
-        message_count += 1
+def build_task_validator(characters: list[str]) -> re.Pattern[str]:
+    """Compile a pattern matching non-blank lines not spoken by one of the characters."""
+    names = "|".join(map(re.escape, characters))
+    return re.compile(rf"(?m)^(?!(?:{names}): .+$)[^\n]*\S[^\n]*$")
 
-    if message_count == 0:
-        return False, "No valid messages found"
 
-    return True, ""
+def validate_transcript_fast(
+    text: str, task_validator: re.Pattern[str], allowed_characters: set[str]
+) -> tuple[bool, str]:
+    """Validate a transcript with a single search of a per-task pattern.
+
+    Expects text with "\\n" line breaks (see normalize_lines). Falls back to
+    validate_transcript to build the error message on failure.
+    """
+    stripped = text.strip()
+    if stripped and not task_validator.search(stripped):
+        return True, ""
+    return validate_transcript(text, allowed_characters)
 
 
 def extract_characters(transcript: str) -> set[str]:
     """Extract the set of unique character names from a validated transcript."""
-    characters = set()
-    for line in transcript.splitlines():
-        match = MESSAGE_RE.match(line)
-        if match:
-            characters.add(match.group(1))
-    return characters
+    return {match.group(1) for match in MESSAGE_RE.finditer(transcript)}
 
 
-def generate_conversation(
-    client: OpenAI,
+async def generate_conversation(
+    client: AsyncOpenAI,
     model: str,
     system_prompt: str,
     characters: list[str],
     message_count: int,
+    topic: str,
     max_retries: int = 3,
 ) -> str | None:
     """Generate a single conversation transcript with retries.
 
     Returns the validated transcript text, or None if all retries failed.
     """
-    topic = random.choice(TOPICS)
     user_prompt = build_user_prompt(characters, message_count, topic)
     allowed = set(characters)
+    task_validator = build_task_validator(characters)
 
     logger.debug("Characters: %s, Topic: %s", characters, topic)
 
+    # Same system message first on every request so the server can reuse
+    # the cached prompt prefix across files and retries.
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
     for attempt in range(1, max_retries + 1):
         try:
-            response = client.chat.completions.create(
+            response = await client.chat.completions.create(
                 model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ],
+                messages=messages,
                 temperature=0.8,
             )
-            text = response.choices[0].message.content.strip()
+            text = normalize_lines(response.choices[0].message.content)
 
-            is_valid, error = validate_transcript(text, allowed)
+            is_valid, error = validate_transcript_fast(text, task_validator, allowed)
             if is_valid:
                 return text
 
@@ -163,16 +219,72 @@ def generate_conversation(
         except Exception as e:
             logger.warning("Attempt %d: LLM error: %s", attempt, e)
             if attempt < max_retries:
-                time.sleep(2**attempt)
+                await asyncio.sleep(2**attempt)
 
     return None
 
 
+async def generate_all(
+    client: AsyncOpenAI,
+    model: str,
+    system_prompt: str,
+    characters: list[str],
+    count: int,
+    message_count: int,
+    output_dir: Path,
+    parallel: int,
+    rng: random.Random,
+) -> list[str | None]:
+    """Generate `count` transcript files concurrently, at most `parallel` at a time.
+
+    Returns the transcripts in file order, with None for files that were skipped.
+    """
+    sem = asyncio.Semaphore(parallel)
+
+    async def generate_one(i: int, selected: list[str], topic: str) -> str | None:
+        file_name = f"{i:03d}.txt"
+        file_path = output_dir / file_name
+
+        async with sem:
+            print(f"[{i}/{count}] Generating {file_name} with {selected}...")
+
+            transcript = await generate_conversation(
+                client=client,
+                model=model,
+                system_prompt=system_prompt,
+                characters=selected,
+                message_count=message_count,
+                topic=topic,
+            )
+
+        if transcript is None:
+            logger.warning("Skipping %s: all retries failed", file_name)
+            return None
+
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(transcript)
+            f.write("\n")
+        logger.debug("Wrote %s", file_path)
+        return transcript
+
+    # Walk the topics in a shuffled order so they repeat as rarely as possible
+    topics = itertools.cycle(rng.sample(TOPICS, len(TOPICS)))
+
+    tasks = []
+    for i in range(1, count + 1):
+        # Pick 2-4 random characters for this conversation
+        num_chars = rng.randint(2, min(4, len(characters)))
+        selected = rng.sample(characters, num_chars)
+        tasks.append(generate_one(i, selected, next(topics)))
+
+    return await asyncio.gather(*tasks)
+
+
 def parse_characters(value: str) -> list[str]:
     """Parse and validate a comma-separated character list."""
     names = [name.strip() for name in value.split(",") if name.strip()]
     for name in names:
-        if not re.match(r"^[a-z]+$", name):
+        if not LOWER_NAME_RE.match(name):
             print(f"Error: invalid character name {name!r} (must be lowercase a-z only)", file=sys.stderr)
             sys.exit(1)
     return names
@@ -188,6 +300,7 @@ def main() -> None:
     parser.add_argument("--output-dir", type=str, default="inputs/", help="Output directory (default: inputs/)")
     parser.add_argument("--model", type=str, default="gpt-oss:20b", help="Ollama model name (default: gpt-oss:20b)")
     parser.add_argument("--ground-truth", type=str, default=None, help="Path for ground-truth JSON (default: <ground-truth.json)")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for character and topic selection")
     parser.add_argument("--verbose", action="store_true", help="Enable debug logging")
 
     args = parser.parse_args()
@@ -211,13 +324,12 @@ def main() -> None:
         if not char_path.exists():
             print(f"Error: characters file not found: {char_path}", file=sys.stderr)
             sys.exit(1)
-        with open(char_path, encoding="utf-8") as f:
-            characters = json.load(f)
+        characters = _loads(char_path.read_bytes())
         if not isinstance(characters, list) or not all(isinstance(c, str) for c in characters):
             print("Error: characters file must contain a JSON array of strings", file=sys.stderr)
             sys.exit(1)
         for name in characters:
-            if not re.match(r"^[a-z]+$", name):
+            if not LOWER_NAME_RE.match(name):
                 print(f"Error: invalid character name {name!r} in file (must be lowercase a-z only)", file=sys.stderr)
                 sys.exit(1)
 
@@ -230,46 +342,50 @@ def main() -> None:
     output_dir.mkdir(parents=True, exist_ok=True)
 
     # Set up OpenAI client pointing to Ollama
-    client = OpenAI(base_url=base_url, api_key="ollama")
+    client = AsyncOpenAI(base_url=base_url, api_key="ollama")
 
     # Load format spec and build system prompt
     format_spec = load_format_spec()
     system_prompt = build_system_prompt(format_spec)
 
+    # Number of in-flight requests; match the server's OLLAMA_NUM_PARALLEL
+    try:
+        parallel = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+    except ValueError:
+        parallel = 0
+    if parallel < 1:
+        print("Error: OLLAMA_NUM_PARALLEL must be a positive integer", file=sys.stderr)
+        sys.exit(1)
+
     logger.debug("Model: %s", args.model)
     logger.debug("Character pool: %s", characters)
     logger.debug("Output directory: %s", output_dir)
+    logger.debug("Parallel requests: %d", parallel)
 
-    succeeded = 0
-    failed = 0
-    counts: dict[str, int] = {}
-
-    for i in range(1, args.count + 1):
-        # Pick 2-4 random characters for this conversation
-        num_chars = random.randint(2, min(4, len(characters)))
-        selected = random.sample(characters, num_chars)
-
-        file_name = f"{i:03d}.txt"
-        file_path = output_dir / file_name
-
-        print(f"[{i}/{args.count}] Generating {file_name} with {selected}...")
-
-        transcript = generate_conversation(
+    transcripts = asyncio.run(
+        generate_all(
             client=client,
             model=args.model,
             system_prompt=system_prompt,
-            characters=selected,
+            characters=characters,
+            count=args.count,
             message_count=args.messages,
+            output_dir=output_dir,
+            parallel=parallel,
+            rng=random.Random(args.seed),
         )
+    )
+
+    succeeded = 0
+    failed = 0
+    counts: dict[str, int] = {}
 
+    for transcript in transcripts:
         if transcript is None:
-            logger.warning("Skipping %s: all retries failed", file_name)
             failed += 1
             continue
 
-        file_path.write_text(transcript + "\n", encoding="utf-8")
         succeeded += 1
-        logger.debug("Wrote %s", file_path)
 
         # Update ground-truth counts (per-file appearance)
         for name in extract_characters(transcript):
@@ -281,7 +397,7 @@ def main() -> None:
     if succeeded > 0:
         gt_path = Path(args.ground_truth) if args.ground_truth else output_dir.parent / "ground-truth.json"
         sorted_counts = dict(sorted(counts.items()))
-        gt_path.write_text(json.dumps(sorted_counts, indent=2) + "\n", encoding="utf-8")
+        gt_path.write_text(_dumps(sorted_counts) + "\n", encoding="utf-8")
         print(f"Ground-truth written to {gt_path}")
 
     if failed > 0: